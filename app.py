@@ -1,130 +1,464 @@
-from fastapi import FastAPI, HTTPException
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Dict, Optional
-from fastapi.responses import Response  # Добавим правильный импорт для Response
-import httpx
+from typing import Annotated, List, Dict, Optional
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse  # Добавим правильный импорт для Response
+from starlette.background import BackgroundTask
+import aiohttp
+import anyio
+from cachetools import TTLCache
+import hashlib
+import msgspec
+import logging
+import os
+import orjson
+import redis
+import redis.asyncio
 import re
-from libgen_api_local import LibgenSearch
+import requests
+from tenacity import AsyncRetrying, retry_if_exception, stop_after_attempt, wait_exponential
+from functools import partial
+from libgen_api_local import COLUMN_NAMES, LibgenSearch, parse_download_links
 
-app = FastAPI()
+logger = logging.getLogger(__name__)
+
+# Scraping runs in worker threads; the default limit of 40 would queue concurrent searches
+THREAD_LIMIT = 200
+# Proxied downloads are relayed in chunks of this size instead of being buffered whole
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# Conditional request headers forwarded upstream, and the validators passed back to the client
+CONDITIONAL_HEADERS = ("if-none-match", "if-modified-since")
+VALIDATOR_HEADERS = ("ETag", "Last-Modified")
+DOWNLOAD_CACHE_CONTROL = "public, max-age=86400"
+CORS_ORIGINS = [origin.strip() for origin in os.environ.get("CORS_ORIGINS", "*").split(",")]
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREAD_LIMIT
+    # One pooled session for all outbound requests, so keep-alive connections are reused
+    app.state.http = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(
+            limit=200, limit_per_host=32, ttl_dns_cache=300, keepalive_timeout=30.0
+        ),
+        timeout=aiohttp.ClientTimeout(total=None, connect=10.0, sock_read=30.0),
+    )
+    yield
+    await app.state.http.close()
+    if shared_cache is not None:
+        await shared_cache.aclose()
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],  # "*" allows all domains, you can specify a list of domains instead
+    allow_origins=CORS_ORIGINS,  # "*" allows all domains; set CORS_ORIGINS to a comma-separated list to restrict
     allow_credentials=True,
-    allow_methods=["*"],  # Allows all HTTP methods (GET, POST, etc.)
-    allow_headers=["*"],  # Allows all headers
+    allow_methods=["GET", "POST"],  # The API only serves GET and POST
+    allow_headers=[
+        "content-type",
+        "if-none-match",
+        "if-modified-since",
+        # Headers vercel.json used to allow; kept so existing clients still pass preflight
+        "accept",
+        "accept-version",
+        "content-length",
+        "content-md5",
+        "date",
+        "x-api-version",
+        "x-csrf-token",
+        "x-requested-with",
+    ],
+    expose_headers=["ETag", "Last-Modified", "Content-Disposition"],
+    max_age=86400,  # Browsers may cache the preflight result for a day
 )
 
 # Initialize the LibgenSearch object
 searcher = LibgenSearch()
 
-# Pydantic models
-class Filter(BaseModel):
+def make_etag(body: bytes) -> str:
+    """Return a strong ETag for a serialized response body."""
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+STATIC_CACHE_CONTROL = "public, max-age=3600"
+SEARCH_CACHE_CONTROL = "public, max-age=60"
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header matches etag, using weak comparison (RFC 9110 13.1.2).
+
+    Handles "*", comma-separated lists and W/ tags, e.g. from a proxy that gzips our responses.
+    """
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque_tag = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque_tag for tag in if_none_match.split(","))
+
+def json_response(request: Request, body: bytes, headers: Dict[str, str]) -> Response:
+    """Return the JSON body, or an empty 304 if the client already has its ETag.
+
+    headers carries the ETag and Cache-Control sent with either response.
+    """
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+# Static payloads and their response headers are built once at import
+COLUMNS_BODY = orjson.dumps(COLUMN_NAMES)
+COLUMNS_HEADERS = {"ETag": make_etag(COLUMNS_BODY), "Cache-Control": STATIC_CACHE_CONTROL}
+
+ROOT_BODY = orjson.dumps({
+    "message": "Welcome to the Libgen API! Use /docs for the interactive API documentation.",
+    "endpoints": [
+        "/search/title",
+        "/search/author",
+        "/search/title/filtered",
+        "/search/author/filtered",
+        "/resolve",
+        "/columns"
+    ]
+})
+ROOT_HEADERS = {"ETag": make_etag(ROOT_BODY), "Cache-Control": STATIC_CACHE_CONTROL}
+
+# Item fields holding mirror page URLs, resolved concurrently by /resolve, in order of
+# precedence: Mirror_2 is the page layout parse_download_links was written for
+MIRROR_KEYS = ("Mirror_2", "Mirror_1", "Mirror_3", "Mirror_4", "Mirror_5")
+# Per-mirror request budget, so a dead mirror cannot hold up /resolve
+MIRROR_TIMEOUT = aiohttp.ClientTimeout(total=10.0)
+
+# Serialized scrape results are kept in memory for a few minutes, keyed on query and filters.
+# With REDIS_URL set, Redis is a second level shared by all worker processes.
+# The in-process level keeps entries much shorter than Redis, so an entry read from
+# Redis near its expiry is not served for another full TTL.
+CACHE_TTL = 300
+LOCAL_CACHE_TTL = 30
+REDIS_URL = os.environ.get("REDIS_URL")
+shared_cache = redis.asyncio.from_url(REDIS_URL) if REDIS_URL else None
+results_cache = TTLCache(maxsize=10_000, ttl=LOCAL_CACHE_TTL if shared_cache is not None else CACHE_TTL)
+_cache_locks: Dict[tuple, asyncio.Lock] = {}
+# Requests holding or waiting on each lock; a lock is dropped only when none are left
+_cache_lock_users: Dict[tuple, int] = {}
+
+# Bound on concurrent outbound scrapes, so libgen is not flooded into rate-limiting us.
+# SCRAPE_CONCURRENCY is the total for the whole server, split evenly across worker processes.
+SCRAPE_CONCURRENCY = int(os.environ.get("SCRAPE_CONCURRENCY", "16"))
+WORKERS = int(os.environ.get("WEB_CONCURRENCY", "1"))
+SCRAPE_ATTEMPTS = 3
+scrape_semaphore = asyncio.Semaphore(max(1, SCRAPE_CONCURRENCY // WORKERS))
+
+def shared_cache_key(key: tuple) -> str:
+    """Return the Redis key for a cache key; keys hold only strings, so repr is stable."""
+    return "libgen:" + hashlib.blake2b(repr(key).encode(), digest_size=16).hexdigest()
+
+async def cached(key: tuple, fetch):
+    """Return the cached (JSON body, ETag) for key, awaiting fetch() once on a miss.
+
+    Concurrent misses for the same key wait on a shared lock, so only one
+    of them per process actually scrapes libgen. Redis errors are logged
+    and treated as misses.
+    """
+    result = results_cache.get(key)
+    if result is not None:
+        return result
+    lock = _cache_locks.setdefault(key, asyncio.Lock())
+    _cache_lock_users[key] = _cache_lock_users.get(key, 0) + 1
+    try:
+        async with lock:
+            result = results_cache.get(key)
+            if result is not None:
+                return result
+            body = None
+            if shared_cache is not None:
+                try:
+                    body = await shared_cache.get(shared_cache_key(key))
+                except redis.RedisError as exc:
+                    logger.warning("Shared cache read failed: %r", exc)
+            if body is not None:
+                result = body, make_etag(body)
+            else:
+                result = await fetch()
+                if shared_cache is not None:
+                    try:
+                        await shared_cache.setex(shared_cache_key(key), CACHE_TTL, result[0])
+                    except redis.RedisError as exc:
+                        logger.warning("Shared cache write failed: %r", exc)
+            results_cache[key] = result
+            return result
+    finally:
+        _cache_lock_users[key] -= 1
+        if not _cache_lock_users[key]:
+            del _cache_lock_users[key]
+            del _cache_locks[key]
+
+def is_retryable(exc: BaseException) -> bool:
+    """Whether an upstream error is throttling or a server error worth retrying."""
+    if isinstance(exc, aiohttp.ClientResponseError):
+        status = exc.status
+    elif isinstance(exc, requests.HTTPError) and exc.response is not None:
+        status = exc.response.status_code
+    else:
+        return False
+    return status == 429 or status >= 500
+
+async def polite(fetch):
+    """Await fetch() under the scrape semaphore, retrying throttled calls with backoff.
+
+    The semaphore is released between attempts, so backing off does not hold a slot.
+    """
+    async for attempt in AsyncRetrying(
+        retry=retry_if_exception(is_retryable),
+        stop=stop_after_attempt(SCRAPE_ATTEMPTS),
+        wait=wait_exponential(multiplier=0.5, max=8),
+        reraise=True,
+    ):
+        with attempt:
+            async with scrape_semaphore:
+                return await fetch()
+
+def scrape(func, *args, **kwargs):
+    """Return a fetch callable running a blocking scraper method in a worker thread."""
+    return lambda: polite(lambda: anyio.to_thread.run_sync(partial(func, *args, **kwargs)))
+
+def serialized(fetch):
+    """Wrap a fetch callable so it returns its result as a (JSON body, ETag) pair."""
+    async def fetch_serialized():
+        body = orjson.dumps(await fetch())
+        return body, make_etag(body)
+    return fetch_serialized
+
+# Request body models, decoded and validated by msgspec in a single pass
+class Filter(msgspec.Struct, frozen=True, forbid_unknown_fields=True):
     field: str
     value: str
     exact_match: Optional[bool] = True
 
-class SearchRequest(BaseModel):
-    query: str
+class SearchRequest(msgspec.Struct):
+    # Checked while decoding, so a short query is rejected before the filters are parsed
+    query: Annotated[str, msgspec.Meta(min_length=3)]
     filters: Optional[List[Filter]] = None
 
-@app.get("/search/title", response_model=List[Dict])
-def search_by_title(query: str):
+def msgspec_error_detail(exc: msgspec.DecodeError) -> List[Dict]:
+    """Translate a msgspec error into FastAPI's [{"loc", "msg", "type"}] validation error list."""
+    message, _, path = str(exc).partition(" - at `$")
+    loc = ["body"]
+    for field, index in re.findall(r"\.(\w+)|\[(\d+)\]", path.rstrip("`")):
+        loc.append(field or int(index))
+    error_type = "value_error" if isinstance(exc, msgspec.ValidationError) else "json_invalid"
+    return [{"loc": loc, "msg": message, "type": error_type}]
+
+async def decode_search_request(request: Request) -> SearchRequest:
+    """Decode the POST body into a SearchRequest, answering 422 if it is invalid."""
+    try:
+        return msgspec.json.decode(await request.body(), type=SearchRequest)
+    except msgspec.DecodeError as exc:
+        raise RequestValidationError(msgspec_error_detail(exc))
+
+def inline_schema(tp) -> Dict:
+    """Return the JSON schema of a msgspec type with every $ref inlined, for OpenAPI docs."""
+    (schema,), components = msgspec.json.schema_components((tp,), ref_template="{name}")
+
+    def resolve(node):
+        if isinstance(node, dict):
+            if "$ref" in node:
+                return resolve(components[node["$ref"]])
+            return {key: resolve(value) for key, value in node.items()}
+        if isinstance(node, list):
+            return [resolve(value) for value in node]
+        return node
+
+    return resolve(schema)
+
+# FastAPI cannot introspect msgspec bodies, so the request schema is documented explicitly
+SEARCH_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {"application/json": {"schema": inline_schema(SearchRequest)}},
+    }
+}
+
+def collect_filters(request: SearchRequest):
+    """Return the {field: value} filters and the combined exact_match flag in one pass."""
+    filters = {}
+    exact_match = True
+    for filter in request.filters or ():
+        filters[filter.field] = filter.value
+        exact_match = exact_match and bool(filter.exact_match)
+    return filters, exact_match
+
+@app.get("/search/title")
+async def search_by_title(query: str, request: Request):
     """Perform a basic search by title."""
     if len(query) < 3:
         raise HTTPException(status_code=400, detail="Query must be at least 3 characters long.")
-    results = searcher.search_title(query)
-    print(results)
-    return results
+    body, etag = await cached(("title", query), serialized(scrape(searcher.search_title, query)))
+    logger.debug("search_title: %d bytes", len(body))
+    return json_response(request, body, {"ETag": etag, "Cache-Control": SEARCH_CACHE_CONTROL})
 
-@app.get("/search/author", response_model=List[Dict])
-def search_by_author(query: str):
+@app.get("/search/author")
+async def search_by_author(query: str, request: Request):
     """Perform a basic search by author."""
     if len(query) < 3:
         raise HTTPException(status_code=400, detail="Query must be at least 3 characters long.")
-    results = searcher.search_author(query)
-    return results
+    body, etag = await cached(("author", query), serialized(scrape(searcher.search_author, query)))
+    return json_response(request, body, {"ETag": etag, "Cache-Control": SEARCH_CACHE_CONTROL})
 
-@app.post("/search/title/filtered", response_model=List[Dict])
-def search_title_filtered(request: SearchRequest):
+@app.post("/search/title/filtered", openapi_extra=SEARCH_REQUEST_BODY)
+async def search_title_filtered(request: SearchRequest = Depends(decode_search_request)):
     """Perform a filtered search by title."""
-    if len(request.query) < 3:
-        raise HTTPException(status_code=400, detail="Query must be at least 3 characters long.")
-    filters = {filter.field: filter.value for filter in request.filters or []}
-    exact_match = all(filter.exact_match for filter in request.filters or [])
-    results = searcher.search_title_filtered(request.query, filters, exact_match=exact_match)
-    return results
+    filters, exact_match = collect_filters(request)
+    body, _ = await cached(
+        ("title_filtered", request.query, tuple(sorted(filters.items())), exact_match),
+        serialized(scrape(searcher.search_title_filtered, request.query, filters, exact_match=exact_match)),
+    )
+    return Response(body, media_type="application/json")
 
-@app.post("/search/author/filtered", response_model=List[Dict])
-def search_author_filtered(request: SearchRequest):
+@app.post("/search/author/filtered", openapi_extra=SEARCH_REQUEST_BODY)
+async def search_author_filtered(request: SearchRequest = Depends(decode_search_request)):
     """Perform a filtered search by author."""
-    if len(request.query) < 3:
-        raise HTTPException(status_code=400, detail="Query must be at least 3 characters long.")
-    filters = {filter.field: filter.value for filter in request.filters or []}
-    exact_match = all(filter.exact_match for filter in request.filters or [])
-    results = searcher.search_author_filtered(request.query, filters, exact_match=exact_match)
-    return results
+    filters, exact_match = collect_filters(request)
+    body, _ = await cached(
+        ("author_filtered", request.query, tuple(sorted(filters.items())), exact_match),
+        serialized(scrape(searcher.search_author_filtered, request.query, filters, exact_match=exact_match)),
+    )
+    return Response(body, media_type="application/json")
 
-@app.post("/resolve", response_model=Dict[str, str])
-def resolve_download_links(item: Dict):
+@app.post("/resolve")
+async def resolve_download_links(item: Dict, request: Request):
     """Resolve the mirror links for a given item to direct download links."""
+    client = request.app.state.http
+    mirror_urls = tuple(
+        item[key] for key in MIRROR_KEYS if str(item.get(key, "")).startswith("http")
+    )
+    if not mirror_urls:
+        raise HTTPException(status_code=400, detail="Item has no mirror links to resolve.")
+
+    async def fetch_parse(url):
+        async with client.get(url, timeout=MIRROR_TIMEOUT) as response:
+            response.raise_for_status()
+            return parse_download_links(await response.text(), url)
+
+    async def fetch():
+        # Mirrors are fetched concurrently, but we only wait until the best mirror
+        # (by MIRROR_KEYS precedence) that has not failed produces links. Only that
+        # mirror's links are returned, so the result does not depend on which
+        # lower-precedence mirrors happened to answer first.
+        tasks = [asyncio.ensure_future(polite(partial(fetch_parse, url))) for url in mirror_urls]
+        try:
+            while True:
+                best = next(
+                    (task for task in tasks if not task.done() or (not task.exception() and task.result())),
+                    None,
+                )
+                if best is None or best.done():
+                    break
+                await asyncio.wait(
+                    [task for task in tasks if not task.done()], return_when=asyncio.FIRST_COMPLETED
+                )
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        errors = []
+        for url, task in zip(mirror_urls, tasks):
+            if task.done() and not task.cancelled() and task.exception() is not None:
+                logger.warning("Failed to resolve mirror %s: %r", url, task.exception())
+                errors.append(task.exception())
+        if best is not None:
+            return best.result()
+        if len(errors) == len(tasks):
+            raise errors[0]
+        return {}
+
     try:
-        download_links = searcher.resolve_download_links(item)
+        body, _ = await cached(("resolve", mirror_urls), serialized(fetch))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error resolving download links: {str(e)}")
-    return download_links
+    return Response(body, media_type="application/json")
 
 @app.get("/columns", response_model=List[str])
-def get_column_names():
+async def get_column_names(request: Request):
     """Return the list of available filterable fields."""
-    col_names = [
-        "ID", "Author", "Title", "Publisher", "Year", "Pages", "Language",
-        "Size", "Extension", "Mirror_1", "Mirror_2", "Mirror_3", "Mirror_4", "Mirror_5", "Edit"
-    ]
-    return col_names
+    return json_response(request, COLUMNS_BODY, COLUMNS_HEADERS)
 
 @app.get("/", response_model=Dict)
-def root():
-    return {
-        "message": "Welcome to the Libgen API! Use /docs for the interactive API documentation.",
-        "endpoints": [
-            "/search/title",
-            "/search/author",
-            "/search/title/filtered",
-            "/search/author/filtered",
-            "/resolve",
-            "/columns"
-        ]
-    }
+async def root(request: Request):
+    return json_response(request, ROOT_BODY, ROOT_HEADERS)
 
 @app.get("/download")
-async def download_file(file_url: str):
+async def download_file(file_url: str, request: Request):
     """Proxy file download through your server."""
     
     # Пытаться не проверять формат ссылки, если хотите загружать любые файлы
     # Можно добавить дополнительную проверку на допустимость URL или не делать её вообще
 
+    client = request.app.state.http
+    # Условные заголовки клиента передаём источнику, чтобы неизменённый файл не качать заново
+    conditional_headers = {
+        name: request.headers[name] for name in CONDITIONAL_HEADERS if name in request.headers
+    }
     try:
-        async with httpx.AsyncClient() as client:
-            # Отправка GET-запроса по ссылке
-            response = await client.get(file_url)
-            response.raise_for_status()  # Выбросить исключение, если получен некорректный ответ (например, 404 или 500)
-
-            # Определение типа файла из заголовков ответа
-            content_type = response.headers.get("Content-Type", "application/octet-stream")
-            
-            # Получаем имя файла из URL или из заголовка Content-Disposition
-            filename = file_url.split("/")[-1]
-
-            # Отправляем файл как ответ с нужными заголовками
-            headers = {'Content-Disposition': f'attachment; filename="{filename}"'}
-            return Response(content=response.content, media_type=content_type, headers=headers)
-
-    except httpx.RequestError as exc:
+        # Отправка GET-запроса по ссылке; тело не читаем, а передаём клиенту по частям
+        response = await client.get(file_url, headers=conditional_headers)
+    except aiohttp.ClientError as exc:
         raise HTTPException(status_code=500, detail=f"Error downloading file: {exc}")
 
-    except httpx.HTTPStatusError as exc:
-        raise HTTPException(status_code=exc.response.status_code, detail=f"Error downloading file: {exc.response.text}")
\ No newline at end of file
+    validators = {
+        name: response.headers[name] for name in VALIDATOR_HEADERS if name in response.headers
+    }
+    # Кэширование файла определяет источник; своё значение только если он его не задал.
+    # Ответ 304 обновляет заголовки сохранённого ответа, поэтому правило то же, что и для 200
+    cache_control = response.headers.get('Cache-Control', DOWNLOAD_CACHE_CONTROL)
+    if response.status == 304:
+        response.release()
+        return Response(status_code=304, headers={**validators, 'Cache-Control': cache_control})
+
+    # Выбросить исключение, если получен некорректный ответ (например, 404 или 500)
+    if response.status >= 400:
+        text = await response.text()
+        response.release()
+        raise HTTPException(status_code=response.status, detail=f"Error downloading file: {text}")
+
+    # Определение типа файла из заголовков ответа
+    content_type = response.headers.get("Content-Type", "application/octet-stream")
+
+    # Получаем имя файла из заголовка Content-Disposition или из URL
+    filename = file_url.rpartition("/")[2]
+    headers = {
+        'Content-Disposition': response.headers.get(
+            'Content-Disposition', f'attachment; filename="{filename}"'
+        ),
+        'Cache-Control': cache_control,
+        **validators,
+    }
+    # Длина известна заранее, только если источник не сжимал тело
+    if 'Content-Length' in response.headers and 'Content-Encoding' not in response.headers:
+        headers['Content-Length'] = response.headers['Content-Length']
+
+    # Отправляем файл потоком, соединение с источником закрывается после отдачи
+    return StreamingResponse(
+        response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE),
+        media_type=content_type,
+        headers=headers,
+        background=BackgroundTask(response.release),
+    )
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    # One worker process per core, since a single event loop saturates one CPU. Set in the
+    # environment before the workers start, so each sizes its scrape semaphore by the count.
+    os.environ.setdefault("WEB_CONCURRENCY", str(os.cpu_count() or 1))
+    # "auto" picks the faster uvloop event loop and httptools parser when installed
+    # (uvloop is not available on Windows), falling back to asyncio and h11.
+    uvicorn.run(
+        "app:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="auto",
+        http="auto",
+        workers=int(os.environ["WEB_CONCURRENCY"]),
+    )
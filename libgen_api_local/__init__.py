@@ -1,2 +1,2 @@
-from .search_request import SearchRequest
-from .libgen_search import LibgenSearch
\ No newline at end of file
+from .search_request import SearchRequest, COLUMN_NAMES
+from .libgen_search import LibgenSearch, parse_download_links
\ No newline at end of file
@@ -1,5 +1,5 @@
-from .search_request import SearchRequest
-import requests
+from .search_request import REQUEST_TIMEOUT, SearchRequest, session
+from urllib.parse import urljoin
 from bs4 import BeautifulSoup
 
 MIRROR_SOURCES = ["GET", "Cloudflare", "IPFS.io", "Infura"]
@@ -32,11 +32,22 @@ class LibgenSearch:
 
     def resolve_download_links(self, item):
         mirror_1 = item["Mirror_2"]
-        page = requests.get(mirror_1)
-        soup = BeautifulSoup(page.text, "html.parser")
-        links = soup.find_all("a", string=MIRROR_SOURCES)
-        download_links = {link.string: link["href"] for link in links}
-        return download_links
+        page = session.get(mirror_1, timeout=REQUEST_TIMEOUT)
+        return parse_download_links(page.text, mirror_1)
+
+
+def parse_download_links(html, page_url=""):
+    """
+    Returns a {source: url} dict of the direct download links
+    found on a mirror page.
+    Relative links are resolved against page_url.
+    """
+    soup = BeautifulSoup(html, "html.parser")
+    links = soup.find_all("a", string=MIRROR_SOURCES)
+    download_links = {
+        str(link.string): urljoin(page_url, link["href"]) for link in links
+    }
+    return download_links
 
 
 def filter_results(results, filters, exact_match):
@@ -1,5 +1,6 @@
 import requests
 from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
 
 # WHY
 # The SearchRequest module contains all the internal logic for the library.
@@ -11,25 +12,38 @@ from bs4 import BeautifulSoup
 # req = search_request.SearchRequest("[QUERY]", search_type="[title]")
 
 
+# Shared session, so repeated searches reuse keep-alive connections to libgen
+# instead of paying a TCP and TLS handshake on every request.
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=32))
+session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=32))
+
+# (connect, read) timeouts in seconds for every libgen request made through the session
+REQUEST_TIMEOUT = (10, 30)
+
+# Column names of the libgen results table, in display order
+COLUMN_NAMES = (
+    "ID",
+    "Author",
+    "Title",
+    "Publisher",
+    "Year",
+    "Pages",
+    "Language",
+    "Size",
+    "Extension",
+    "Mirror_1",
+    "Mirror_2",
+    "Mirror_3",
+    "Mirror_4",
+    "Mirror_5",
+    "Edit",
+)
+
+
 class SearchRequest:
 
-    col_names = [
-        "ID",
-        "Author",
-        "Title",
-        "Publisher",
-        "Year",
-        "Pages",
-        "Language",
-        "Size",
-        "Extension",
-        "Mirror_1",
-        "Mirror_2",
-        "Mirror_3",
-        "Mirror_4",
-        "Mirror_5",
-        "Edit",
-    ]
+    col_names = COLUMN_NAMES
 
     def __init__(self, query, search_type="title"):
         self.query = query
@@ -53,7 +67,8 @@ class SearchRequest:
             search_url = (
                 f"https://libgen.is/search.php?req={query_parsed}&column=author"
             )
-        search_page = requests.get(search_url)
+        search_page = session.get(search_url, timeout=REQUEST_TIMEOUT)
+        search_page.raise_for_status()
         return search_page
 
     def aggregate_request_data(self):